@@ -17,20 +17,47 @@ Changelog:
         -Converted duplicated code fragments into helper functions for modularity
         -Replaced np.zeros with np.empty
         -Minor aesthetic chances in exported .txt files
+        -Uses lxml to parse .spx files when installed, else ElementTree
+        -Compiles the regular expressions once at module level
+        -Readers keep file contents in local variables instead of on the
+            FittingData instance, so reset_to_default_values is removed
     FittingData:
+        -Moved attribute defaults into __init__ so instances no longer
+            share the class-level channels/energy_scale arrays and lists
     Functions:
         bruker_txt_test:
             -Changed .readlines() to .readline() since only checking first line
+            -Opens the file in a with block so it is closed on errors
         bruker_txt_import:
             -Changed for loop to use enumerate
             -Created a constant data_file_lines to use in array creation
+            -Replaced the per-line for loop with a single np.fromstring parse
+            -Memory maps the file rather than reading it with readlines
+        bruker_txt_mod, bruker_msa_import:
+            -Memory maps the file rather than reading it with readlines
+        bruker_txt_mod:
+            -Respaces the data block with one re.sub instead of line by line
+        bruker_msa_import:
+            -Reads the header keywords with one regular expression pass
+            -Removes newlines with bytes.translate instead of re.sub,
+                without keeping the untranslated copy in data_lines
         bruker_spx_import:
             -Changed 'level' to 'sublevel' to better show parent-child relationship
             -Rearranged loop structure and added provisions
                 to account for data with channels != 4096
+            -Computes the energy scale with np.arange instead of a for loop
+            -Streams the file with iterparse and a (Type, tag) lookup table
+                in place of the nested for loops
+            -Stores channels as int32 and energy_scale as float32
+            -Parses the channel counts with np.fromstring instead of split
+            -Writes the energy scale in place, into a caller supplied
+                array when given, so batch imports can reuse one buffer
+            -Split into read_spx, returning (channels, energy_scale, metadata),
+                and a wrapper storing them on the FittingData instance
         write_converted_file:
             -Changes file endings
             -Writes to file from a list, adding a newline after each element
+            -Opens the file in a with block so it is closed on errors
 
 """
 #
@@ -48,11 +75,26 @@ Changelog:
 #
 ###########################
 #
-import xml.etree.ElementTree as ET
+try:
+    # libxml2 based parser, faster on large .spx files
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 import re as re
+import mmap
 from datetime import datetime
 import numpy as np
 
+# regular expressions shared by every call of the readers, compiled once
+# MSA header keyword lines read by bruker_msa_import
+# (units may follow the keyword, e.g. '#XPERCHAN -keV: 0.01')
+_MSA_HEADER_RE = re.compile(
+    rb'^#+(XPERCHAN|OFFSET|SPECTRUM)[^:\r\n]*:([^\r\n]*)', re.MULTILINE)
+# spacing between the energy and counts columns of a Bruker .txt file
+_TXT_SPACING_RE = re.compile(rb'[ \t]+')
+# whitespace at the start and end of each line of a Bruker .txt file
+_TXT_LINE_ENDS_RE = re.compile(rb'(?m)^[ \t]+|[ \t]+$')
+
 
 class FittingData:
     """ all parameters imported or exported from Bruker Spectra Files
@@ -68,11 +110,9 @@ class FittingData:
     **calibration_lin:** float [10]
         set value for linearity of Bruker M4 spectr at 40keV setting
 
-    **channels:** np.array [4096,]
-        assuming 4096 MCA channels (Bruker m4)  EDAX uses 4000 instead
-
-    **data_lines:** str [""]
-        dummy string for the parsed lines of an ascii readable file
+    **channels:** np.array [None]
+        MCA channel counts, allocated on import (4096 channels for the
+        Bruker m4, EDAX uses 4000 instead), int32 for .spx files
 
     **date_measure:** str [""]
         date read from Bruker M4 .spx files by ETREE
@@ -83,30 +123,16 @@ class FittingData:
     **detector_type:** str [""]
         detector type from Bruker M4 .spx
 
-    **energy_scale:** np.array [4096,]
-        numpy array of 4096 energy spectra scalings  (initialized as empty)
-
-    **file_content:** str [""]
-        entire ascii file read for import of data
-
-    **file_line:** str ['']
-        the current single line of a data file
-
-    **file_lines:** list of str ['']
-        python list of strings; each list being a line of an imported file
+    **energy_scale:** np.array [None]
+        numpy array of energy spectra scalings (allocated on import),
+        float32 for .spx files
 
     **file_status:** bool [False]
         this boolean is used in test of .txt file = Bruker spectra
 
-    **header_lines:** list of str ['']
-        lines preceding the start of spectra data in import file
-
     **life_time_in_ms:** int [0]
         live time for MCA spectra collection
 
-    **line_count:** int [0]
-        dummy variable used in counting for start of spectra data
-
     **mn_fwhm:** float [143.796]
         manganese fwhm in eV for the detector used in spectra collection
 
@@ -122,9 +148,6 @@ class FittingData:
     **real_time_in_ms:** int [0]
         real time for MCA spectra collection
 
-    **replace_lines:** list of str []
-        list of string lines containing modified spectra data
-
     **shaping_time:** float [0]
         detector count rate shaping time
 
@@ -145,33 +168,27 @@ class FittingData:
     def __init__(self, file_name):
         """ name of spectrum file imported or exported"""
         self.file_name = file_name
-
-    calibration_abs = -955.1
-    calibration_lin = 10
-    channels = np.empty(4096)
-    data_lines = ''
-    date_measure = ''
-    detector_thickness = 0
-    detector_type = ''  #
-    energy_scale = np.empty(4096)
-    file_content = ''
-    file_line = ''
-    file_lines = ''
-    file_status = False
-    header_lines = ''
-    modification = '_modified.txt'
-    life_time_in_ms = 0
-    line_count = 0
-    mn_fwhm = 143.796
-    no_channels = 0
-    pulse_density = ''
-    real_time_in_ms = 0
-    replace_lines = []
-    shaping_time = 0
-    si_dead_layer = ''
-    start_count = 21
-    time_measure = ''
-    window_type = ''
+        self.calibration_abs = -955.1
+        self.calibration_lin = 10
+        # spectra arrays are allocated by the readers once the
+        # number of channels in the file is known
+        self.channels = None
+        self.date_measure = ''
+        self.detector_thickness = 0
+        self.detector_type = ''  #
+        self.energy_scale = None
+        self.file_status = False
+        self.modification = '_modified.txt'
+        self.life_time_in_ms = 0
+        self.mn_fwhm = 143.796
+        self.no_channels = 0
+        self.pulse_density = ''
+        self.real_time_in_ms = 0
+        self.shaping_time = 0
+        self.si_dead_layer = ''
+        self.start_count = 21
+        self.time_measure = ''
+        self.window_type = ''
 
 
 ###########################
@@ -195,8 +212,8 @@ def bruker_txt_test(fitting_data):
     Example
     -------
 
-    >>>> fitting_data.file_status = bool(r'Bruker Nano GmbH Berlin, Germany\\n'
-    >>>>                                in fitting_data.file_lines[0]) 
+    >>>> fitting_data.file_status = bool('Bruker Nano GmbH Berlin, Germany\\n'
+    >>>>                                 == first_line)
 
     See Also
     --------
@@ -209,12 +226,10 @@ def bruker_txt_test(fitting_data):
     #        fitting_data.file_status = bool(r'Bruker Nano GmbH Berlin, Germany\\n'
     #                                       in fitting_data.file_lines[0]) """Build and fit a model of an EDS Signal1D.
     #
-    fitting_data.file_content = open(fitting_data.file_name)
-    fitting_data.file_line = fitting_data.file_content.readline()
-    fitting_data.file_content.close()
+    with open(fitting_data.file_name) as file_content:
+        first_line = file_content.readline()
     fitting_data.file_status = bool('Bruker Nano GmbH Berlin, Germany\n'
-                                    == fitting_data.file_line)
-    reset_to_default_values(fitting_data)
+                                    == first_line)
     return
 
 
@@ -226,44 +241,26 @@ def bruker_txt_test(fitting_data):
 def bruker_txt_import(fitting_data):
     """ Function to import the Bruker *.txt* spectra data
 
-    The working portion of this import breaks the 2 column (energy,counts)
-    spectral data into two numpy arrays via an inefficient *for* loop:
+    The working portion of this import hands the 2 column (energy,counts)
+    spectral data to numpy in a single call and splits the result into
+    two numpy arrays:
 
     .. code-block:: python
 
-        fitting_data.energy_scale[i] = np.float(split_line[0])
-        fitting_data.channels[i] = np.float(split_line[1])
+        data = np.fromstring(data_block, sep=' ')
+        data = data.reshape(-1, 2)
 
     """
-    # open Bruker .txt file and read lines
-    txt_read_lines(fitting_data)
-    # determine the start position of the energy, counts data
-    txt_start_count(fitting_data)
-    # extract the data beginning at the start count
-    fitting_data.data_lines = fitting_data.file_lines[fitting_data.start_count:]
-
-    # a constant for use in future arrays and loops
-    data_lines_range = len(fitting_data.data_lines)
+    # maps the Bruker .txt file and extracts the energy, counts data
+    header_lines, data_block = txt_read_lines(fitting_data)
 
-    # keeps only the lines of spectral data
-    fitting_data.energy_scale = np.empty(data_lines_range)
-    fitting_data.channels = np.empty(data_lines_range)
-
-    # split the data into energy and channels
-
-    for index, file_line in enumerate(fitting_data.data_lines):
-        split_line = file_line.split()
-        fitting_data.energy_scale[index] = np.float(split_line[0])
-        fitting_data.channels[index] = np.float(split_line[1])
-
-    # for index, file_line in enumerate(fitting_data.data_lines):
-    #     split_line = [np.float(item) for item in file_line.split()]
-    #     fitting_data.energy_scale[index] = split_line[0]
-    #     fitting_data.channels[index] = split_line[1]
+    # parses all (energy, counts) pairs at once and splits into columns
+    data = np.fromstring(data_block, sep=' ').reshape(-1, 2)
+    fitting_data.energy_scale = data[:, 0].copy()
+    fitting_data.channels = data[:, 1].copy()
 
     # provides two 1D arrays with the energy and counts data
     print('import size: ', fitting_data.channels.shape)
-    reset_to_default_values(fitting_data)
     return  # these counts have been pulse pile up modified
 
 
@@ -284,25 +281,17 @@ def bruker_txt_mod(fitting_data):
     """
 
     print('size into string on export: ', fitting_data.channels.shape)
-    txt_read_lines(fitting_data)
-    txt_start_count(fitting_data)
-
     # extracts lines with information and lines with data
-    fitting_data.header_lines = fitting_data.file_lines[:fitting_data.start_count]
-    fitting_data.data_lines = fitting_data.file_lines[fitting_data.start_count:]
-
-    fitting_data.replace_lines = []
+    header_lines, data_block = txt_read_lines(fitting_data)
 
-    # keeps only the lines of spectral data
-    for data_line in fitting_data.data_lines:
-        split_line = data_line.split()
-        replace_line = '    '.join(split_line) + '\n'
-        fitting_data.replace_lines.append(replace_line)
+    # respaces the energy, counts columns of the whole data block at once
+    data_block = _TXT_LINE_ENDS_RE.sub(b'', data_block.translate(None, b'\r'))
+    data_block = _TXT_SPACING_RE.sub(b'    ', data_block)
 
-    text_list = fitting_data.header_lines + fitting_data.replace_lines
+    text_list = ([header_line + '\n' for header_line in header_lines]
+                 + [data_block.decode()])
 
     write_converted_file(fitting_data, text_list, 'modification', False)
-    reset_to_default_values(fitting_data)
     return
 
 
@@ -315,138 +304,173 @@ def bruker_txt_mod(fitting_data):
 def bruker_msa_import(fitting_data):
     """function to open Bruker MSA format spectra files"""
     print(fitting_data.file_name)
-    fitting_data.file_content = open(fitting_data.file_name)
-    fitting_data.file_lines = fitting_data.file_content.readlines()
-    fitting_data.file_content.close()
-    fitting_data.line_count = 0
-    for fitting_data.file_line in fitting_data.file_lines:
-        # finds the start of the error data
-        fitting_data.line_count = fitting_data.line_count + 1
-        # looks for the word 'Spectrum' in each line
-        if fitting_data.file_line.find('XPERCHAN') != -1:
-            splitline = fitting_data.file_line.split(':')
-            fitting_data.calibration_lin = 1000 * float(splitline[1])
-        if fitting_data.file_line.find('OFFSET') != -1:
-            splitline = fitting_data.file_line.split(':')
-            fitting_data.calibration_abs = -10 * float(splitline[1])
-        if fitting_data.file_line.find('SPECTRUM') != -1:
-            # startMSA local variable only for indexing end of MSA header
-            start_msa = fitting_data.line_count
-    fitting_data.data_lines = fitting_data.file_lines[start_msa:-1]
-    # keeps only the lines of error data
-    string = ''.join(fitting_data.data_lines)
-    new_string = re.sub("\n", '', string)
-    fitting_data.channels = np.fromstring(new_string, sep=',')
+    with open(fitting_data.file_name, 'rb') as file_content:
+        with mmap.mmap(file_content.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped:
+            # walks the header keywords once, stopping at SPECTRUM
+            for keyword in _MSA_HEADER_RE.finditer(mapped):
+                if keyword.group(1) == b'XPERCHAN':
+                    fitting_data.calibration_lin = 1000 * float(keyword.group(2))
+                elif keyword.group(1) == b'OFFSET':
+                    fitting_data.calibration_abs = -10 * float(keyword.group(2))
+                else:
+                    # the spectrum data starts on the line after SPECTRUM
+                    start_msa = mapped.find(b'\n', keyword.end()) + 1
+                    break
+            # and runs up to the closing #ENDOFDATA keyword
+            end_msa = mapped.find(b'#', start_msa)
+            if end_msa == -1:
+                end_msa = len(mapped)
+            # keeps only the lines of error data, the sliced copy of the
+            # mapping is released as soon as the newlines are removed
+            data_block = mapped[start_msa:end_msa].translate(None, b'\r\n')
+    fitting_data.channels = np.fromstring(data_block, sep=',')
     fitting_data.energy_scale = (fitting_data.calibration_abs +
                                  np.arange(4096) * fitting_data.calibration_lin)
-    reset_to_default_values(fitting_data)
     return
 
 
+###########################
+#  Bruker *.spx* fields read by bruker_spx_import, keyed by the Type of the
+#  ClassInstance holding the field and the field tag.  Each entry gives the
+#  name the value is stored under and the conversion applied to its text
+#
+_SPX_FIELDS = {
+    # collection time information
+    ('TRTSpectrumHardwareHeader', 'RealTime'): ('real_time_in_ms', float),
+    ('TRTSpectrumHardwareHeader', 'LifeTime'): ('life_time_in_ms', float),
+    ('TRTSpectrumHardwareHeader', 'PulseDensity'): ('pulse_density', str),
+    ('TRTSpectrumHardwareHeader', 'ShapingTime'): ('shaping_time', float),
+    # detector info
+    ('TRTDetectorHeader', 'Type'): ('detector_type', str),
+    ('TRTDetectorHeader', 'DetectorThickness'): ('detector_thickness', float),
+    ('TRTDetectorHeader', 'SiDeadLayerThickness'): ('si_dead_layer', str),
+    ('TRTDetectorHeader', 'WindowType'): ('window_type', str),
+    # energy calibration info
+    ('TRTSpectrumHeader', 'Date'): ('date', str),
+    ('TRTSpectrumHeader', 'Time'): ('time', str),
+    ('TRTSpectrumHeader', 'ChannelCount'): ('no_channels', str),
+    ('TRTSpectrumHeader', 'CalibAbs'): ('calibration_abs', float),
+    ('TRTSpectrumHeader', 'CalibLin'): ('calibration_lin', float),
+    ('TRTSpectrumHeader', 'SigmaAbs'): ('sigma_abs', float),
+    ('TRTSpectrumHeader', 'SigmaLin'): ('sigma_lin', float),
+    # comma delimited list of channel intensity
+    ('TRTSpectrum', 'Channels'):
+        ('channels', lambda text: np.fromstring(text, sep=',', dtype=np.int32)),
+}
+# the measured spectrum and its headers are at most two ClassInstances deep,
+# deeper ones (e.g. the fitted background spectrum) are skipped
+_SPX_MAX_DEPTH = 2
+
+
 ###########################
 #  20190426 Donald Windover
 #  This function reads in the *.SPX file, passes the channels and energy
 #  for modification
 #
-def bruker_spx_import(fitting_data):
-    """function to import channels and energy info from Bruker *.spx* file"""
-    #
-    # establish 4096 array to take the channel data from an spx file
-    # for the Bruker spx data (assumes all 4096 channels present)
-    #
-    # counts_spx = np.empty((1,4096))
-    # prints which file is being converted
-    #
+def read_spx(file_name, energy_scale=None):
+    """function to read channels and energy info from a Bruker *.spx* file
+
+    The XML file is streamed with *iterparse* so each element is visited
+    once, and the fields listed in *_SPX_FIELDS* are picked out by a single
+    dictionary lookup on (ClassInstance Type, tag).
+
+    When energy_scale is an array of no_channels values the energy scale
+    is written into it and it is returned in the tuple, so a batch of
+    imports can reuse one buffer; otherwise a new float32 array is made.
+
+    Returns
+    -------
+
+    (channels, energy_scale, metadata), where metadata is a dict keyed by
+    the matching FittingData attribute names, or None if the file cannot
+    be parsed
+
+    """
+    spx = {}
+    # Types of the ClassInstances enclosing the current element
+    class_types = []
+    # tags of the elements enclosing the current element
+    parent_tags = []
     try:
-        # opens the XML file
-        tree = ET.parse(open(fitting_data.file_name, "r"))
-        root = tree.getroot()
-        # print(r'SPXFile: ', fitting_data.file_name)
-    except TypeError:
+        # streams the XML file
+        for event, element in ET.iterparse(file_name, events=('start', 'end')):
+            if event == 'start':
+                parent_tags.append(element.tag)
+                if element.tag == 'ClassInstance':
+                    class_types.append(element.get('Type'))
+                continue
+            parent_tags.pop()
+            if element.tag == 'ClassInstance':
+                class_types.pop()
+            elif (parent_tags and parent_tags[-1] == 'ClassInstance'
+                  and len(class_types) <= _SPX_MAX_DEPTH):
+                field = _SPX_FIELDS.get((class_types[-1], element.tag))
+                if field is not None:
+                    spx[field[0]] = field[1](element.text)
+            # the element has been read, so its content can be released
+            element.clear()
+    except (OSError, ET.ParseError):
         # fails gracefully, if filename or format is not XML.
-        print("Unable to open and parse input definition file: "
-              + fitting_data.FileName)
-    # pulls in the channel data
-    for sublevel_two in root:
-        # pulls in the parameters needed for the txt file
-        for sublevel_three in sublevel_two:
-            if sublevel_three.tag == 'TRTHeaderedClass':
-                for sublevel_four in sublevel_three:
-                    # pulls in the collection time information
-                    if {'Type': 'TRTSpectrumHardwareHeader'} == sublevel_four.attrib:
-                        for sublevel_five in sublevel_four:
-                            if sublevel_five.tag == 'RealTime':
-                                fitting_data.real_time_in_ms = np.float(
-                                    sublevel_five.text)
-                            if sublevel_five.tag == 'LifeTime':
-                                fitting_data.life_time_in_ms = np.float(
-                                    sublevel_five.text)
-                            if sublevel_five.tag == 'PulseDensity':
-                                fitting_data.pulse_density = sublevel_five.text
-                            if sublevel_five.tag == 'ShapingTime':
-                                fitting_data.shaping_time = np.float(
-                                    sublevel_five.text)
-                    if {'Type': 'TRTDetectorHeader'} == sublevel_four.attrib:
-                        for sublevel_five in sublevel_four:
-                            # pulls is in the detector info
-                            if sublevel_five.tag == 'Type':
-                                fitting_data.detector_type = sublevel_five.text
-                            if sublevel_five.tag == 'DetectorThickness':
-                                fitting_data.detector_thickness = float(sublevel_five.text)
-                            if sublevel_five.tag == 'SiDeadLayerThickness':
-                                fitting_data.si_dead_layer = sublevel_five.text
-                            if sublevel_five.tag == 'WindowType':
-                                fitting_data.window_type = sublevel_five.text
-            if {'Type': 'TRTSpectrumHeader'} == sublevel_three.attrib:
-                for sublevel_four in sublevel_three:
-                    # pulls in the energy calibration info
-                    if sublevel_four.tag == 'Date':
-                        date = sublevel_four.text
-                    if sublevel_four.tag == 'Time':
-                        time = sublevel_four.text
-                    if sublevel_four.tag == 'ChannelCount':
-                        fitting_data.no_channels = sublevel_four.text
-                        # formats channels and energy arrays to match
-                        # the number of channels
-                        fitting_data.channels = np.empty(int(sublevel_four.text))
-                        fitting_data.energy_scale = np.empty(int(sublevel_four.text))
-                        if sublevel_four.text != "4096":
-                            print("NOTE: Number of channels is " + sublevel_four.text
-                                  + ", instead of the default 4096.")
-                    if sublevel_four.tag == 'CalibAbs':
-                        calibration_abs = np.float(sublevel_four.text)
-                    if sublevel_four.tag == 'CalibLin':
-                        calibration_lin = np.float(sublevel_four.text)
-                    if sublevel_four.tag == 'SigmaAbs':
-                        sigma_abs = np.float(sublevel_four.text)
-                    if sublevel_four.tag == 'SigmaLin':
-                        sigma_lin = np.float(sublevel_four.text)
-        if sublevel_two.find('Channels') is not None:
-            channels = sublevel_two.find('Channels')
-            fitting_data.channels = np.asarray(channels.text.split(','), dtype=int)
-            # print('import size: ', fitting_data.channels.shape)
+        print("Unable to open and parse input definition file: " + file_name)
+        return None
+    # pulls in the parameters needed for the txt file
+    metadata = {name: spx[name]
+                for name in ('real_time_in_ms', 'life_time_in_ms',
+                             'pulse_density', 'shaping_time', 'detector_type',
+                             'detector_thickness', 'si_dead_layer',
+                             'window_type')
+                if name in spx}
+    no_channels = spx['no_channels']
+    metadata['no_channels'] = no_channels
+    if no_channels != "4096":
+        print("NOTE: Number of channels is " + no_channels
+              + ", instead of the default 4096.")
     # converts the time to the correct format
-    time = datetime.strptime(time, "%H:%M:%S")
-    fitting_data.time_measure = time.strftime("%I:%M:%S %p")
+    time = datetime.strptime(spx['time'], "%H:%M:%S")
+    metadata['time_measure'] = time.strftime("%I:%M:%S %p")
     # converts the date to the correct format
-    date = datetime.strptime(date, "%d.%m.%Y")
-    fitting_data.date_measure = date.strftime("%m/%d/%Y")
+    date = datetime.strptime(spx['date'], "%d.%m.%Y")
+    metadata['date_measure'] = date.strftime("%m/%d/%Y")
     # rescales energy calibration factors for the txt format
-    fitting_data.calibration_abs = 1000 * calibration_abs
-    fitting_data.calibration_lin = 1000 * calibration_lin
+    calibration_abs = 1000 * spx['calibration_abs']
+    calibration_lin = 1000 * spx['calibration_lin']
+    metadata['calibration_abs'] = calibration_abs
+    metadata['calibration_lin'] = calibration_lin
     # Energy used in the calucation of Mn FWHM (approximated on 2017/10/19)
     mn_energy = 5.900
     # Formula given by Bruker (Falk Reinhardt) on 2017/10/19
-    sigma = np.sqrt(sigma_abs + mn_energy * sigma_lin)
+    sigma = np.sqrt(spx['sigma_abs'] + mn_energy * spx['sigma_lin'])
     fwhm_factor = 1000 * np.sqrt(8 * np.log(2)) * sigma
-    fitting_data.mn_fwhm = float(fwhm_factor)  # we now know the calc rather than needing a const.
-    # print(fitting_data.mn_fwhm)
-    # Energy scale calculation
-    fitting_data.energy_scale = np.empty(int(fitting_data.no_channels))
-    for i in np.arange(int(fitting_data.no_channels)):
-        fitting_data.energy_scale[i] = (fitting_data.calibration_abs +
-                                        fitting_data.calibration_lin * i) / 1000
-    return  # provides the comma delimited list of channel intensity
+    metadata['mn_fwhm'] = float(fwhm_factor)  # we now know the calc rather than needing a const.
+    # Energy scale calculation (stored as float32), computed in place
+    if energy_scale is None or energy_scale.shape != (int(no_channels),):
+        energy_scale = np.empty(int(no_channels), dtype=np.float32)
+    np.multiply(np.arange(int(no_channels)), calibration_lin, out=energy_scale)
+    energy_scale += calibration_abs
+    energy_scale /= 1000
+    # provides the comma delimited list of channel intensity
+    return spx['channels'], energy_scale, metadata
+
+
+###########################
+#  This function stores the *.spx* data read by read_spx in a FittingData
+#  instance, keeping the interface used by the analysis scripts
+#
+def bruker_spx_import(fitting_data):
+    """function to import channels and energy info from Bruker *.spx* file
+
+    Reads the file with *read_spx* and copies the channels, energy_scale
+    and metadata onto fitting_data.  The tuple from *read_spx* is returned.
+
+    """
+    spectrum = read_spx(fitting_data.file_name)
+    if spectrum is None:
+        return None
+    fitting_data.channels, fitting_data.energy_scale, metadata = spectrum
+    for name, value in metadata.items():
+        setattr(fitting_data, name, value)
+    return spectrum
 
 
 ###########################
@@ -459,8 +483,9 @@ def bruker_spx_to_txt_convert(fitting_data):
     """function converting Bruker *.spx* to *.txt* """
     # prints which file is being converted
     print(fitting_data.file_name)
-    #
-    bruker_spx_import(fitting_data)
+    # stops if the file cannot be read
+    if bruker_spx_import(fitting_data) is None:
+        return
     # text file data formatting
     text_header = []
     text_header.append(r'Bruker Nano GmbH Berlin, Germany')
@@ -485,9 +510,13 @@ def bruker_spx_to_txt_convert(fitting_data):
     text_header.append(r'Channels: ' + fitting_data.no_channels)
     text_header.append(r'')
     text_header.append(r'Energy     Counts')
-    # including energy and counts
+    # including energy and counts, the energy is recalculated in double
+    # precision so the rounding matches the Bruker .txt output
+    energy_scale = spx_energy_scale(fitting_data.calibration_abs,
+                                    fitting_data.calibration_lin,
+                                    fitting_data.no_channels)
     for index in np.arange(int(fitting_data.no_channels)):
-        text_header.append('%.4f' % fitting_data.energy_scale[index] +
+        text_header.append('%.4f' % energy_scale[index] +
                            '    ' + '%.0f' % fitting_data.channels[index])
     write_converted_file(fitting_data, text_header, 'spx_to_txt')
     return
@@ -540,43 +569,36 @@ def test_io():
 #
 
 
-# helper function that opens a .txt and reads the lines
+# helper function that maps a .txt and returns the header lines
+# and the bytes of the energy, counts data
 def txt_read_lines(fitting_data):
-    fitting_data.file_content = open(fitting_data.file_name)
-    fitting_data.file_lines = fitting_data.file_content.readlines()
-    fitting_data.file_content.close()
-
-
-# helper function to determine the start line of the energy, counts data
-def txt_start_count(fitting_data):
-    # checks whether default start_count line is where
-    # the energy, counts data begins
-    # bypasses start count verification if default values hold true
-    if fitting_data.file_lines[fitting_data.start_count].find('Counts') != -1:
-        pass
-    # else count the line where energy, counts data begins
-    else:
-        fitting_data.line_count = 0
-        # finds the start of the error data
-        for fitting_data.file_line in fitting_data.file_lines:
-            fitting_data.line_count += 1
-            # looks for the word 'Counts' in each line
-            if fitting_data.file_line.find('Counts') != -1:
-                start_count = fitting_data.line_count
-                # print a warning if start count is different than default
-                if fitting_data.start_count != start_count:
-                    print('warning: start of channels != normal value')
-                    fitting_data.start_count = start_count
-
-
-# helper function to clear values
-def reset_to_default_values(fitting_data):
-    fitting_data.file_content = ''
-    fitting_data.file_line = ''
-    fitting_data.file_lines = ''
-    fitting_data.header_lines = ''
-    fitting_data.data_lines = ''
-    fitting_data.replace_lines = []
+    with open(fitting_data.file_name, 'rb') as file_content:
+        with mmap.mmap(file_content.fileno(), 0,
+                       access=mmap.ACCESS_READ) as mapped:
+            data_start = txt_start_count(fitting_data, mapped)
+            header_lines = mapped[:data_start].decode().splitlines()
+            data_block = mapped[data_start:]
+    return header_lines, data_block
+
+
+# helper function to determine the start of the energy, counts data
+def txt_start_count(fitting_data, mapped):
+    # the data begins on the line after the 'Energy Counts' header
+    data_start = mapped.find(b'\n', mapped.find(b'Counts')) + 1
+    start_count = mapped[:data_start].count(b'\n')
+    # print a warning if start count is different than default
+    if fitting_data.start_count != start_count:
+        print('warning: start of channels != normal value')
+        fitting_data.start_count = start_count
+    # returns the byte offset of the first data line
+    return data_start
+
+
+# helper function to calculate the energy scale of an .spx file
+# from its calibration factors
+def spx_energy_scale(calibration_abs, calibration_lin, no_channels):
+    return (calibration_abs + calibration_lin *
+            np.arange(int(no_channels), dtype=np.float64)) / 1000
 
 
 # helper function to write lines from the text source into
@@ -591,7 +613,6 @@ def write_converted_file(fitting_data, text_source, operation, separator='\n'):
     elif operation == 'modification':
         file_name_mod = fitting_data.file_name.replace('.txt', fitting_data.modification)
     # writing the file
-    file = open(file_name_mod, "w")
-    # writes text_source to a txt file, adding a newline after each line
-    file.writelines(["%s" % line + separator for line in text_source])
-    file.close()
+    with open(file_name_mod, "w") as file:
+        # writes text_source to a txt file, adding a newline after each line
+        file.writelines(["%s" % line + separator for line in text_source])
@@ -4,6 +4,42 @@ import numpy as np
 import bruker_io
 import os
 
+try:
+    from numba import njit
+except ImportError:
+    # without numba the functions below run as plain numpy code
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+
+@njit(cache=True, fastmath=True)
+def Gauss(x, a, x0, sigma):
+    return a * np.exp(-(x - x0) ** 2 / (2 * sigma ** 2))
+
+
+@njit(cache=True, fastmath=True)
+def Gauss_jacobian(x, a, x0, sigma):
+    # partial derivatives of Gauss with respect to a, x0 and sigma
+    dx = x - x0
+    g = np.exp(-dx ** 2 / (2 * sigma ** 2))
+    jacobian = np.empty((x.size, 3))
+    jacobian[:, 0] = g
+    jacobian[:, 1] = a * g * dx / sigma ** 2
+    jacobian[:, 2] = a * g * dx ** 2 / sigma ** 3
+    return jacobian
+
+
+@njit(cache=True, error_model='numpy')
+def moments(x, y):
+    # weighted arithmetic mean and standard deviation of the peak in each
+    # row of x, y (one spectrum per row), computed in double precision
+    x = x.astype(np.float64)
+    sum_y = y.sum(axis=-1)
+    mean = (x * y).sum(axis=-1) / sum_y
+    dx = x - mean.reshape((-1, 1))
+    sigma = np.sqrt((y * dx * dx).sum(axis=-1) / sum_y)
+    return mean, sigma
+
 
 def element_b(element, start=0, end=None):
     species = os.path.join("Trials", "Element B " + element + ".spx")
@@ -18,20 +54,80 @@ def glass(sequence, start=0, end=None):
 
 
 def gauss_fit(dataset, name, start, end):
-    bruker_io.bruker_spx_import(dataset)
+    popt = gauss_params(dataset, start, end)
+    if popt is None:
+        return
+    plot_gauss(dataset.energy_scale[start:end], dataset.channels[start:end],
+               popt, name)
+
+
+def gauss_params(dataset, start, end):
+    # no parameters if the file cannot be read
+    if bruker_io.bruker_spx_import(dataset) is None:
+        return None
 
     x = dataset.energy_scale[start:end]
     y = dataset.channels[start:end]
 
     # weighted arithmetic mean (corrected - check the section below)
-    mean = sum(x * y) / sum(y)
-    sigma = np.sqrt(sum(y * (x - mean) ** 2) / sum(y))
+    mean, sigma = moments(x[np.newaxis], y[np.newaxis])
+
+    popt, pcov = curve_fit(Gauss, x, y, p0=[max(y), mean[0], sigma[0]],
+                           jac=Gauss_jacobian)
+    return popt
+
+
+def gauss_fit_many(datasets, start=0, end=None):
+    # fits the same window of many spectra without plotting, one row of
+    # (a, x0, sigma) per dataset, nan where the file cannot be read or the
+    # fit fails or cannot start. The files are read by file_name only, the
+    # datasets are left unchanged
+    windows = []
+    energy_scale = None
+    for dataset in datasets:
+        spectrum = bruker_io.read_spx(dataset.file_name, energy_scale)
+        if spectrum is None:
+            # unreadable file, left as a nan row
+            windows.append(None)
+            continue
+        channels, energy_scale, metadata = spectrum
+        # copies the window so the next read can reuse the energy scale
+        windows.append((energy_scale[start:end].copy(), channels[start:end]))
+
+    popts = np.full((len(windows), 3), np.nan)
+    rows = [row for row, window in enumerate(windows) if window is not None]
+    if not rows:
+        return popts
+
+    if len({windows[row][0].size for row in rows}) == 1:
+        # weighted arithmetic mean and sigma of every spectrum at once
+        mean, sigma = moments(np.stack([windows[row][0] for row in rows]),
+                              np.stack([windows[row][1] for row in rows]))
+    else:
+        # spectra with different channel counts give windows of different
+        # lengths, which cannot be stacked, so each row is taken on its own
+        mean = np.empty(len(rows))
+        sigma = np.empty(len(rows))
+        for index, row in enumerate(rows):
+            x, y = windows[row]
+            row_moments = moments(x[np.newaxis], y[np.newaxis])
+            mean[index], sigma[index] = row_moments[0][0], row_moments[1][0]
 
-    def Gauss(x, a, x0, sigma):
-        return a * np.exp(-(x - x0) ** 2 / (2 * sigma ** 2))
+    for index, row in enumerate(rows):
+        x, y = windows[row]
+        p0 = [y.max() if y.size else np.nan, mean[index], sigma[index]]
+        # a window without counts has no start point to fit from
+        if not np.all(np.isfinite(p0)):
+            continue
+        try:
+            popts[row], pcov = curve_fit(Gauss, x, y, p0=p0,
+                                         jac=Gauss_jacobian)
+        except (RuntimeError, ValueError, TypeError):
+            pass
+    return popts
 
-    popt, pcov = curve_fit(Gauss, x, y, p0=[max(y), mean, sigma])
 
+def plot_gauss(x, y, popt, name):
     plt.figure(num=None, figsize=(7, 3), dpi=80, facecolor='w', edgecolor='k')
     plt.plot(x, y, marker='o', label='data')
     plt.plot(x, Gauss(x, *popt), marker='+', label='fit')